@@ -1,4 +1,24 @@
 import os
+import re
+from typing import FrozenSet
+
+_ADMINS_SEP_RE = re.compile(r"[,;\s]+")
+
+
+def parse_admins(v: str) -> FrozenSet[int]:
+    """
+    Числовые ID через запятую, ; или пробел. Мусорный токен (например, @name) —
+    ошибка запуска: молча выкинуть его значило бы открыть бота всем при пустом списке.
+    """
+    out = set()
+    for tok in _ADMINS_SEP_RE.split((v or "").strip()):
+        if not tok:
+            continue
+        if not tok.isdecimal():
+            raise ValueError(f"ADMINS: некорректный ID {tok!r} — нужны числовые ID через запятую")
+        out.add(int(tok))
+    return frozenset(out)
+
 
 # === Бот / Канал / Часовой пояс ===
 BOT_TOKEN   = os.getenv("BOT_TOKEN", "").strip()
@@ -6,7 +26,7 @@ CHANNEL_ID  = os.getenv("CHANNEL_ID", "").strip()     # @username или -100...
 TZ          = os.getenv("TZ", "Europe/Moscow").strip()
 
 # === Админы (числовые ID через запятую) ===
-ADMINS = [int(a.strip()) for a in os.getenv("ADMINS", "").split(",") if a.strip()]
+ADMINS = parse_admins(os.getenv("ADMINS", ""))
 
 # === Единый стиль: ссылка на общий альбом и контакт ===
 ALBUM_URL    = os.getenv("ALBUM_URL", "").strip()
@@ -1,15 +1,21 @@
 import os
+import html
 import json
 import asyncio
 import logging
+import functools
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
-
-import pytz
+from typing import Deque, Dict, FrozenSet, List, Optional, Set, Tuple, Union
+from zoneinfo import ZoneInfo
 from aiogram import Bot, Dispatcher, F
 from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode, ChatType
-from aiogram.filters import Command
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.enums import ParseMode, ChatType, MessageOriginType
+from aiogram.filters import Command, CommandObject
 from aiogram.types import (
     Message,
     CallbackQuery,
@@ -19,10 +25,22 @@ from aiogram.types import (
     InputMediaVideo,
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 
+from config import parse_admins
+
+# uvloop (libuv) быстрее стандартного цикла; политику ставим при импорте — до asyncio.run
+# и в main.py, и в runner.py. На Windows uvloop нет — остаётся стандартный цикл.
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
 # ======================
 # ЛОГГЕР
 # ======================
@@ -39,84 +57,165 @@ TOKEN = os.getenv("TOKEN")
 if not TOKEN:
     raise RuntimeError("ENV TOKEN пуст или имеет неверный формат. Задайте корректный токен бота.")
 
-ADMINS: List[int] = [int(x) for x in os.getenv("ADMINS", "").split(",") if x.strip()]
+ADMINS: FrozenSet[int] = parse_admins(os.getenv("ADMINS", ""))
 CHANNEL_ID = int(os.getenv("CHANNEL_ID"))
 ALBUM_URL = os.getenv("ALBUM_URL", "").strip()
 CONTACT = os.getenv("CONTACT", "").strip()
 POST_TIMES: List[str] = [s.strip() for s in os.getenv("POST_TIMES", "12:00,16:00,20:00").split(",") if s.strip()]
 PREVIEW_BEFORE_MIN = int(os.getenv("PREVIEW_BEFORE_MIN", "45"))
 TZ = os.getenv("TZ", "Europe/Moscow")
-
-tz = pytz.timezone(TZ)
-
-bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher()
-scheduler = AsyncIOScheduler(timezone=tz)
+# если задан — принимаем апдейты вебхуком (Telegram сам шлёт POST), иначе long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip().rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/tg")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip() or None
+PORT = int(os.getenv("PORT", "8080"))
+
+# stdlib zoneinfo вместо pytz: с ним datetime.replace() на стыке DST даёт верное смещение
+_TZ_INFO = ZoneInfo(TZ)
+
+# одна aiohttp-сессия с keep-alive на весь процесс; таймаут запроса с запасом
+# больше long-poll таймаута getUpdates (POLLING_TIMEOUT), иначе ответ обрывается.
+# все запросы идут на один хост api.telegram.org: 32 соединений хватает на рассылку
+# админам + параллельные send/delete, а пул не раздувается до дефолтных 100
+POLLING_TIMEOUT = 30
+HTTP_POOL_LIMIT = 32
+bot = Bot(
+    token=TOKEN,
+    session=AiohttpSession(timeout=60, limit=HTTP_POOL_LIMIT),
+    default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+)
+# FSM-состояния боту не нужны. Голый Dispatcher() сам создаёт MemoryStorage, а тот заводит
+# запись на каждый (chat, user) без вытеснения — поэтому FSM выключаем явно
+dp = Dispatcher(disable_fsm=True)
+scheduler = AsyncIOScheduler(timezone=_TZ_INFO)
 
 # ======================
 # STORAGE DB API
 # ======================
 # ожидаем файл storage/db.py с функциями:
-# init_db(), enqueue(items, caption, src), dequeue_oldest(), peek_all(), delete_by_id(qid), stats()
+# init_db(), enqueue_counted(items, caption, src, src_msg_ids), enqueue_album(gid, ...),
+# dequeue_oldest(), pop_oldest_if(qid), peek_oldest(), peek_all(), delete_by_id(qid), stats()
 import storage.db as storage_db
 
 try:
     storage_db.init_db()
     log.info("DB initialized (storage_db.init_db()).")
 except Exception as e:
-    log.warning(f"init_db failed: {e}")
+    log.warning("init_db failed: %s", e)
+
+# sqlite3 синхронный: каждый вызов уходит в отдельный пул потоков, чтобы fsync/ожидание
+# блокировки не останавливали event loop (поллинг, отправки). Пул свой и маленький:
+# записи в storage.db всё равно идут по одной, а читающих соединений больше не нужно
+_DB_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="sqlite")
+
+async def _db_call(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_DB_EXECUTOR, fn, *args)
 
-def db_enqueue(items: List[dict], caption: str, src: Tuple[Optional[int], Optional[int]]) -> int:
-    return int(storage_db.enqueue(items, caption, src))
+async def db_enqueue(items: List[dict], caption: str, src: Tuple[Optional[int], Optional[int]],
+                     src_msg_ids: Optional[List[int]] = None) -> Tuple[int, int]:
+    """(id новой записи, размер очереди после вставки)."""
+    return await _db_call(storage_db.enqueue_counted, items, caption, src, src_msg_ids)
 
-def db_dequeue_oldest() -> Optional[dict]:
-    return storage_db.dequeue_oldest()
+async def db_enqueue_album(gid: str, bucket: "AlbumBucket") -> Tuple[int, int]:
+    """Альбом в очередь + удаление из album_buf одной транзакцией: (id, queued)."""
+    return await _db_call(storage_db.enqueue_album, gid, bucket.items, bucket.caption, bucket.src,
+                          bucket.src_msg_ids)
 
-def db_peek_all() -> List[dict]:
-    return storage_db.peek_all()
+async def db_dequeue_oldest() -> Optional[dict]:
+    return await _db_call(storage_db.dequeue_oldest)
 
-def db_delete_by_id(qid: int) -> int:
-    return int(storage_db.delete_by_id(qid))
+async def db_pop_oldest_if(qid: int) -> Optional[dict]:
+    """Снять голову очереди, только если это qid; проверка и удаление — одна транзакция."""
+    return await _db_call(storage_db.pop_oldest_if, qid)
 
-def db_stats() -> dict:
+async def db_peek_oldest() -> Optional[dict]:
+    return await _db_call(storage_db.peek_oldest)
+
+async def db_peek_all() -> List[dict]:
+    return await _db_call(storage_db.peek_all)
+
+async def db_delete_by_id(qid: int) -> int:
+    return int(await _db_call(storage_db.delete_by_id, qid))
+
+async def db_save_album(gid: str, bucket: "AlbumBucket") -> None:
+    # копия списка: пока поток пишет, в bucket.items могут дописываться новые куски
+    await _db_call(storage_db.save_album_bucket, gid, list(bucket.items), bucket.caption, bucket.src,
+                   list(bucket.src_msg_ids))
+
+async def db_load_albums() -> List[dict]:
+    return await _db_call(storage_db.load_album_buckets)
+
+async def db_stats() -> dict:
     try:
-        return storage_db.stats()
+        return await _db_call(storage_db.stats)
     except Exception:
         # совместимость
-        return {"queued": len(db_peek_all())}
+        return {"queued": len(await db_peek_all())}
 
 # ======================
 # ТЕКСТ/ПОДПИСИ
 # ======================
 
+_FOOTER_PREFIXES = ("Общий альбом:", "Покупка/вопросы:")
+
 def fixed_footer() -> str:
+    # подпись уходит с parse_mode=HTML: "&" в ссылке (?a=1&b=2) или "<" в контакте
+    # без экранирования ломают отправку целиком
     footer = []
     if ALBUM_URL:
-        footer.append(f"Общий альбом: {ALBUM_URL}")
+        footer.append(f"Общий альбом: {html.escape(ALBUM_URL, quote=False)}")
     if CONTACT:
-        footer.append(f"Покупка/вопросы: {CONTACT}")
+        footer.append(f"Покупка/вопросы: {html.escape(CONTACT, quote=False)}")
     return ("\n\n" + "\n".join(footer)) if footer else ""
 
+# ALBUM_URL/CONTACT читаются из ENV один раз — футер собираем при импорте
+_FOOTER = fixed_footer()
+
+# ALBUM_URL/CONTACT фиксированы на весь процесс, поэтому подпись зависит только от raw_caption
+@functools.lru_cache(maxsize=512)
 def build_final_caption(raw_caption: Optional[str]) -> str:
-    raw = (raw_caption or "").strip()
-    lines = [l.strip() for l in raw.splitlines() if l.strip()]
-    body = "\n".join(lines)
-    return (body + fixed_footer()).strip() or fixed_footer().lstrip()
+    # в очереди лежит обычный текст (m.caption/m.text), а шлём с parse_mode=HTML —
+    # экранируем <, >, &, чтобы "Размер <XL>" дошёл как есть, а не сломал отправку
+    lines = [l for l in map(str.strip, html.escape(raw_caption or "", quote=False).splitlines()) if l]
+    # у репоста из канала в конце стоит старый футер — срезаем только этот хвостовой блок
+    # (такие же строки в теле подписи оставляем), актуальный футер добавим ниже
+    while lines and lines[-1].startswith(_FOOTER_PREFIXES):
+        lines.pop()
+    if not lines:
+        return _FOOTER.lstrip()
+    return "\n".join(lines) + _FOOTER
+
+# тип элемента -> класс InputMedia; неизвестные типы в альбом не попадают
+_MEDIA_TYPES = {"photo": InputMediaPhoto, "video": InputMediaVideo}
 
 def build_media_group(items: List[dict], caption: Optional[str]):
-    media = []
-    for idx, it in enumerate(items):
-        t = (it.get("type") or "").lower()
-        if t == "photo":
-            media.append(InputMediaPhoto(media=it["file_id"], caption=caption if idx == 0 and caption else None))
-        elif t == "video":
-            media.append(InputMediaVideo(media=it["file_id"], caption=caption if idx == 0 and caption else None))
+    # сначала отбрасываем неподдерживаемые типы — подпись достаётся первому *годному* элементу
+    valid = [
+        (cls, it["file_id"])
+        for it in items
+        if (cls := _MEDIA_TYPES.get((it.get("type") or "").lower()))
+    ]
+    if not valid:
+        return []
+    # подпись только у первого элемента — его собираем отдельно, остальные без проверки индекса
+    (head_cls, head_id), rest = valid[0], valid[1:]
+    media = [head_cls(media=head_id, caption=caption or None)]
+    media.extend(cls(media=file_id) for cls, file_id in rest)
     return media
 
 # ======================
 # МЕНЮ
 # ======================
 
+def is_admin(event: Union[Message, CallbackQuery]) -> bool:
+    """Фильтр доступа: пустой ADMINS — бот открыт всем."""
+    if not ADMINS:
+        return True
+    user = event.from_user
+    return user is not None and user.id in ADMINS
+
+# клавиатура не меняется — собираем один раз, дальше отдаём тот же объект
+@functools.lru_cache(maxsize=None)
 def menu_kb() -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
     kb.row(
@@ -136,23 +235,21 @@ HELP_TEXT = (
     "Альбом и контакт внизу подписи — фиксированы."
 )
 
-@dp.message(Command("start"))
+@dp.message(Command("start"), is_admin)
 async def cmd_start(m: Message):
-    if ADMINS and m.from_user.id not in ADMINS:
-        return
     await m.answer(HELP_TEXT, reply_markup=menu_kb(), disable_web_page_preview=True)
 
 @dp.callback_query(F.data.startswith("menu:"))
 async def on_menu(cq: CallbackQuery):
-    if ADMINS and cq.from_user.id not in ADMINS:
+    if not is_admin(cq):
         await cq.answer()
         return
     action = cq.data.split(":", 1)[1]
     if action == "queue":
-        s = db_stats()
+        s = await db_stats()
         await cq.message.answer(f"Очередь: {s.get('queued', 0)}", reply_markup=menu_kb())
     elif action == "post_oldest":
-        task = db_dequeue_oldest()
+        task = await db_dequeue_oldest()
         if not task:
             await cq.message.answer("Очередь пуста.", reply_markup=menu_kb())
             await cq.answer()
@@ -165,34 +262,29 @@ async def on_menu(cq: CallbackQuery):
         await cq.message.answer(HELP_TEXT, reply_markup=menu_kb())
     await cq.answer()
 
-@dp.message(Command("queue"))
+@dp.message(Command("queue"), is_admin)
 async def cmd_queue(m: Message):
-    if ADMINS and m.from_user.id not in ADMINS:
-        return
-    s = db_stats()
+    s = await db_stats()
     await m.answer(f"Очередь: {s.get('queued', 0)}")
 
-@dp.message(Command("post_oldest"))
+@dp.message(Command("post_oldest"), is_admin)
 async def cmd_post_oldest(m: Message):
-    if ADMINS and m.from_user.id not in ADMINS:
-        return
-    task = db_dequeue_oldest()
+    task = await db_dequeue_oldest()
     if not task:
         await m.answer("Очередь пуста.")
         return
     await publish_task(task)
     await m.answer(f"✅ Опубликовано: ID {task['id']}")
 
-@dp.message(Command("delete"))
-async def cmd_delete(m: Message):
-    if ADMINS and m.from_user.id not in ADMINS:
-        return
-    parts = m.text.split()
-    if len(parts) != 2 or not parts[1].isdigit():
+@dp.message(Command("delete"), is_admin)
+async def cmd_delete(m: Message, command: CommandObject):
+    # аргументы уже разобраны фильтром Command — повторно m.text не сплитим
+    arg = (command.args or "").strip()
+    if not arg.isdigit():
         await m.answer("Некорректный ID. Попробуй ещё раз.")
         return
-    qid = int(parts[1])
-    cnt = db_delete_by_id(qid)
+    qid = int(arg)
+    cnt = await db_delete_by_id(qid)
     if cnt:
         await m.answer(f"🗑 Удалено: ID {qid}")
     else:
@@ -210,61 +302,74 @@ def preview_kb(qid: int) -> InlineKeyboardMarkup:
     )
     return kb.as_markup()
 
-_PREVIEW_SENT: set[int] = set()
+# id в очереди только растут, голова очереди не возвращается к старому id —
+# достаточно помнить последний отправленный в превью, а не копить множество
+_PREVIEW_LAST_QID: Optional[int] = None
 
 def _parse_hhmm(s: str) -> Tuple[int, int]:
     hh, mm = s.split(":")
     return int(hh), int(mm)
 
+# слоты разбираем один раз при импорте, а не на каждом тике preview_job
+_SLOTS: List[Tuple[int, int]] = [_parse_hhmm(s) for s in POST_TIMES]
+
+async def _send_preview(admin_id: int, items: List[dict], caption: str, qid: int, kb: InlineKeyboardMarkup):
+    if len(items) >= 2:
+        media = build_media_group(items, caption)
+        await bot.send_media_group(admin_id, media)
+        await bot.send_message(admin_id, f"Предпросмотр поста ID <code>{qid}</code>", reply_markup=kb)
+    elif len(items) == 1:
+        it = items[0]
+        t = (it.get("type") or "").lower()
+        if t == "photo":
+            await bot.send_photo(admin_id, it["file_id"], caption=caption, reply_markup=kb)
+        elif t == "video":
+            await bot.send_video(admin_id, it["file_id"], caption=caption, reply_markup=kb)
+        else:
+            await bot.send_message(admin_id, caption, reply_markup=kb)
+    else:
+        await bot.send_message(admin_id, caption, reply_markup=kb)
+
 async def send_preview_to_admins(task: dict):
     items = json.loads(task.get("payload") or task.get("items_json") or "[]")
     caption = build_final_caption(task.get("caption") or "")
     qid = int(task["id"])
 
-    for admin_id in ADMINS:
-        try:
-            if len(items) >= 2:
-                media = build_media_group(items, caption)
-                await bot.send_media_group(admin_id, media)
-                await bot.send_message(admin_id, f"Предпросмотр поста ID <code>{qid}</code>", reply_markup=preview_kb(qid))
-            elif len(items) == 1:
-                it = items[0]
-                t = (it.get("type") or "").lower()
-                if t == "photo":
-                    await bot.send_photo(admin_id, it["file_id"], caption=caption, reply_markup=preview_kb(qid))
-                elif t == "video":
-                    await bot.send_video(admin_id, it["file_id"], caption=caption, reply_markup=preview_kb(qid))
-                else:
-                    await bot.send_message(admin_id, caption, reply_markup=preview_kb(qid))
-            else:
-                await bot.send_message(admin_id, caption, reply_markup=preview_kb(qid))
-        except Exception as e:
-            log.warning(f"Не смог отправить превью админу {admin_id}: {e}")
+    # клавиатура одна на всех админов — собираем один раз
+    kb = preview_kb(qid)
+    # всем админам параллельно; ошибки собираем и логируем по каждому
+    admins = list(ADMINS)
+    results = await asyncio.gather(
+        *(_send_preview(admin_id, items, caption, qid, kb) for admin_id in admins),
+        return_exceptions=True,
+    )
+    for admin_id, res in zip(admins, results):
+        if isinstance(res, Exception):
+            log.warning("Не смог отправить превью админу %s: %s", admin_id, res)
 
 async def preview_job():
-    posts = db_peek_all()
-    if not posts:
+    global _PREVIEW_LAST_QID
+    head = await db_peek_oldest()
+    if not head:
         return
-    head = posts[0]
     qid = int(head["id"])
-    if qid in _PREVIEW_SENT:
+    if qid == _PREVIEW_LAST_QID:
         return
 
-    now = datetime.now(tz)
-    for slot in POST_TIMES:
-        h, m = _parse_hhmm(slot)
+    now = datetime.now(_TZ_INFO)
+    for h, m in _SLOTS:
         slot_dt = now.replace(hour=h, minute=m, second=0, microsecond=0)
         if slot_dt <= now:
             slot_dt += timedelta(days=1)
         preview_dt = slot_dt - timedelta(minutes=PREVIEW_BEFORE_MIN)
         if abs((now - preview_dt).total_seconds()) <= 59:
             await send_preview_to_admins(head)
-            _PREVIEW_SENT.add(qid)
+            _PREVIEW_LAST_QID = qid
             break
 
 @dp.callback_query(F.data.startswith("preview:"))
 async def on_preview_buttons(cq: CallbackQuery):
-    if ADMINS and cq.from_user.id not in ADMINS:
+    if not is_admin(cq):
         await cq.answer()
         return
 
@@ -276,16 +381,15 @@ async def on_preview_buttons(cq: CallbackQuery):
         return
 
     if action == "post":
-        posts = db_peek_all()
-        if not posts or int(posts[0]["id"]) != qid:
+        task = await db_pop_oldest_if(qid)
+        if not task:
             await cq.answer("Этот пост уже не первый в очереди", show_alert=True)
             return
-        task = db_dequeue_oldest()
         await publish_task(task)
         await cq.message.answer(f"✅ Опубликовано и удалено из очереди: ID {qid}")
         await cq.answer()
     elif action == "delete":
-        cnt = db_delete_by_id(qid)
+        cnt = await db_delete_by_id(qid)
         if cnt:
             await cq.message.answer(f"🗑 Удалено из очереди: ID {qid}")
         else:
@@ -299,90 +403,147 @@ async def on_preview_buttons(cq: CallbackQuery):
 # ======================
 
 def _src_from_message(m: Message) -> Tuple[Optional[int], Optional[int]]:
-    try:
-        if m.forward_from_chat and m.forward_from_chat.type == ChatType.CHANNEL:
-            return (m.forward_from_chat.id, m.forward_from_message_id or m.message_id)
-    except Exception:
-        pass
+    # поля pydantic-модели всегда есть (None по умолчанию) — try/except не нужен
+    origin = m.forward_origin
+    if origin is not None and origin.type == MessageOriginType.CHANNEL:
+        return (origin.chat.id, origin.message_id)
+    fc = m.forward_from_chat
+    if fc is not None and fc.type == ChatType.CHANNEL:
+        return (fc.id, m.forward_from_message_id or m.message_id)
     return (None, None)
 
 def _append_item_from_message(m: Message) -> Optional[dict]:
-    if m.photo:
-        return {"type": "photo", "file_id": m.photo[-1].file_id}
-    if m.video:
-        return {"type": "video", "file_id": m.video.file_id}
+    photo = m.photo
+    if photo:
+        return {"type": "photo", "file_id": photo[-1].file_id}
+    video = m.video
+    if video:
+        return {"type": "video", "file_id": video.file_id}
     return None
 
-# буфер альбомов: media_group_id -> {items, caption, src, touched}
-_ALBUM_BUF: Dict[str, dict] = {}
+async def _notify_admin(admin_id: int, text: str):
+    try:
+        # уведомления — простой текст без разметки: HTML-парсинг на стороне Telegram не нужен
+        await bot.send_message(admin_id, text, parse_mode=None)
+    except Exception as e:
+        # один недоступный админ не должен ронять рассылку остальным, но и молча терять нельзя
+        log.warning("Не смог уведомить админа %s: %s", admin_id, e)
+
+async def notify_admins(text: str):
+    # шлём всем админам параллельно: задержка ~1 RTT вместо N × RTT
+    await asyncio.gather(*(_notify_admin(admin_id, text) for admin_id in ADMINS))
+
+@dataclass(slots=True)
+class AlbumBucket:
+    """Части одного альбома, пока Telegram досылает их по одной."""
+    src: Tuple[Optional[int], Optional[int]]
+    touched: float
+    items: List[dict] = field(default_factory=list)
+    caption: str = ""
+    # file_id уже добавленных частей — дубль (повторная доставка апдейта) отсекаем за O(1)
+    seen: Set[str] = field(default_factory=set)
+    # id всех частей исходного альбома в канале — чтобы при публикации удалить его целиком
+    src_msg_ids: List[int] = field(default_factory=list)
+
+# буфер альбомов: media_group_id -> AlbumBucket
+_ALBUM_BUF: Dict[str, AlbumBucket] = {}
+# альбом считается собранным, если новых частей не было столько секунд
+_ALBUM_IDLE_SEC = 1.2
+# (срок, media_group_id) в порядке касаний: сроки не убывают, поэтому сборщик
+# смотрит только на голову очереди, а не перебирает весь буфер
+_ALBUM_EXPIRY: Deque[Tuple[float, str]] = deque()
+# альбомы, изменённые после последнего сохранения в БД: пишем их раз за тик
+# сборщика, а не на каждое фото (альбом из 10 фото — одна-две записи вместо 10)
+_ALBUM_DIRTY: Set[str] = set()
 
 async def _flush_album_group(group_id: str):
     data = _ALBUM_BUF.pop(group_id, None)
     if not data:
         return
-    qid = db_enqueue(data["items"], data["caption"], data["src"])
-    for admin_id in ADMINS:
-        try:
-            await bot.send_message(admin_id, f"✅ Альбом добавлен в очередь, ID {qid}. Сейчас в очереди: {db_stats().get('queued', 0)}")
-        except Exception:
-            pass
+    qid, queued = await db_enqueue_album(group_id, data)
+    await notify_admins(f"✅ Альбом добавлен в очередь, ID {qid}. Сейчас в очереди: {queued}")
 
 async def _album_collector_loop():
     while True:
         try:
-            now = datetime.now(tz)
-            stale = [gid for gid, d in _ALBUM_BUF.items() if (now - d["touched"]).total_seconds() >= 1.2]
-            for gid in stale:
-                await _flush_album_group(gid)
+            now = time.monotonic()
+            while _ALBUM_EXPIRY and _ALBUM_EXPIRY[0][0] <= now:
+                _, gid = _ALBUM_EXPIRY.popleft()
+                data = _ALBUM_BUF.get(gid)
+                # устаревшая запись: после неё альбом ещё раз трогали
+                if data and now - data.touched >= _ALBUM_IDLE_SEC:
+                    await _flush_album_group(gid)
+            # собранные альбомы уже ушли из буфера — сохраняем только недособранные.
+            # забираем набор до await: куски, пришедшие во время записи, попадут в следующий тик
+            dirty = list(_ALBUM_DIRTY)
+            _ALBUM_DIRTY.clear()
+            for gid in dirty:
+                data = _ALBUM_BUF.get(gid)
+                if data:
+                    await db_save_album(gid, data)
         except Exception as e:
-            log.warning(f"album collector error: {e}")
+            log.warning("album collector error: %s", e)
         await asyncio.sleep(0.6)
 
-@dp.message(F.media_group_id)
+@dp.message(F.media_group_id, is_admin)
 async def on_album_piece(m: Message):
-    if ADMINS and m.from_user.id not in ADMINS:
-        return
     gid = m.media_group_id
     it = _append_item_from_message(m)
-    if gid not in _ALBUM_BUF:
-        _ALBUM_BUF[gid] = {
-            "items": [],
-            "caption": (m.caption or "").strip(),
-            "src": _src_from_message(m),
-            "touched": datetime.now(tz),
-        }
-    if it:
-        _ALBUM_BUF[gid]["items"].append(it)
-    if m.caption:
-        _ALBUM_BUF[gid]["caption"] = (m.caption or "").strip()
-    _ALBUM_BUF[gid]["touched"] = datetime.now(tz)
-
-@dp.message(F.photo | F.video)
+    now = time.monotonic()
+    raw_caption = m.caption
+    caption = (raw_caption or "").strip()
+    src_chat_id, src_msg_id = src = _src_from_message(m)
+    bucket = _ALBUM_BUF.get(gid)
+    if bucket is None:
+        bucket = _ALBUM_BUF[gid] = AlbumBucket(
+            src=src,
+            touched=now,
+            caption=caption,
+        )
+    if it and it["file_id"] not in bucket.seen:
+        bucket.items.append(it)
+        bucket.seen.add(it["file_id"])
+    # в альбоме ≤ 10 частей — линейная проверка дешевле отдельного множества
+    if src_msg_id is not None and src_chat_id == bucket.src[0] and src_msg_id not in bucket.src_msg_ids:
+        bucket.src_msg_ids.append(src_msg_id)
+    if raw_caption:
+        bucket.caption = caption
+    bucket.touched = now
+    _ALBUM_EXPIRY.append((now + _ALBUM_IDLE_SEC, gid))
+    _ALBUM_DIRTY.add(gid)
+
+async def _restore_album_buffer():
+    """Вернуть в буфер альбомы, которые не успели собраться до рестарта."""
+    now = time.monotonic()
+    for row in await db_load_albums():
+        gid = row["gid"]
+        items = row["items"]
+        _ALBUM_BUF[gid] = AlbumBucket(
+            src=row["src"],
+            touched=now,
+            items=items,
+            caption=row["caption"],
+            seen={it["file_id"] for it in items},
+            src_msg_ids=row["src_msg_ids"],
+        )
+        _ALBUM_EXPIRY.append((now + _ALBUM_IDLE_SEC, gid))
+    if _ALBUM_BUF:
+        log.info("Восстановлено недособранных альбомов: %s", len(_ALBUM_BUF))
+
+@dp.message(F.photo | F.video, is_admin)
 async def on_single_media(m: Message):
-    if ADMINS and m.from_user.id not in ADMINS:
-        return
     it = _append_item_from_message(m)
     if not it:
         return
-    qid = db_enqueue([it], (m.caption or "").strip(), _src_from_message(m))
-    for admin_id in ADMINS:
-        try:
-            await bot.send_message(admin_id, f"✅ Медиа добавлено в очередь, ID {qid}. Сейчас в очереди: {db_stats().get('queued', 0)}")
-        except Exception:
-            pass
+    qid, queued = await db_enqueue([it], (m.caption or "").strip(), _src_from_message(m))
+    await notify_admins(f"✅ Медиа добавлено в очередь, ID {qid}. Сейчас в очереди: {queued}")
 
-@dp.message(F.text & ~F.media_group_id)
+@dp.message(F.text & ~F.media_group_id, is_admin)
 async def on_text(m: Message):
-    if ADMINS and m.from_user.id not in ADMINS:
-        return
     if m.text.startswith("/"):
         return
-    qid = db_enqueue([], (m.text or "").strip(), _src_from_message(m))
-    for admin_id in ADMINS:
-        try:
-            await bot.send_message(admin_id, f"✅ Текст добавлен в очередь, ID {qid}. Сейчас в очереди: {db_stats().get('queued', 0)}")
-        except Exception:
-            pass
+    qid, queued = await db_enqueue([], (m.text or "").strip(), _src_from_message(m))
+    await notify_admins(f"✅ Текст добавлен в очередь, ID {qid}. Сейчас в очереди: {queued}")
 
 # ======================
 # ПУБЛИКАЦИЯ
@@ -394,22 +555,30 @@ async def _delete_old_source_if_possible(task: dict):
         src_msg_id = task.get("src_msg_id")
         if not src_chat_id or not src_msg_id:
             return
-        if int(src_chat_id) != int(CHANNEL_ID):
+        # CHANNEL_ID уже int (разобран при старте)
+        if int(src_chat_id) != CHANNEL_ID:
+            return
+        # альбом — все его сообщения; одиночный пост — только src_msg_id
+        msg_ids = sorted({int(src_msg_id), *json.loads(task.get("src_msg_ids") or "[]")})
+        if len(msg_ids) == 1:
+            await _delete_channel_message(msg_ids[0])
             return
         try:
-            await bot.delete_message(CHANNEL_ID, int(src_msg_id))
+            # deleteMessages: весь альбом одним запросом вместо N
+            await bot.delete_messages(CHANNEL_ID, msg_ids)
         except Exception as e:
-            log.warning(f"Не смог удалить старый пост {CHANNEL_ID}/{src_msg_id}: {e}")
+            log.warning("delete_messages %s/%s не прошёл (%s) — удаляю по одному", CHANNEL_ID, msg_ids, e)
+            await asyncio.gather(*(_delete_channel_message(mid) for mid in msg_ids))
     except Exception:
         pass
 
-async def publish_task(task: dict):
-    items = json.loads(task.get("payload") or task.get("items_json") or "[]")
-    caption = build_final_caption(task.get("caption") or "")
-
-    # попытка удалить исходник в канале, чтобы не было дубля
-    await _delete_old_source_if_possible(task)
+async def _delete_channel_message(msg_id: int):
+    try:
+        await bot.delete_message(CHANNEL_ID, msg_id)
+    except Exception as e:
+        log.warning("Не смог удалить старый пост %s/%s: %s", CHANNEL_ID, msg_id, e)
 
+async def _send_to_channel(items: List[dict], caption: str):
     if len(items) >= 2:
         media = build_media_group(items, caption)
         await bot.send_media_group(CHANNEL_ID, media)
@@ -425,12 +594,21 @@ async def publish_task(task: dict):
     else:
         await bot.send_message(CHANNEL_ID, caption)
 
+async def publish_task(task: dict):
+    items = json.loads(task.get("payload") or task.get("items_json") or "[]")
+    caption = build_final_caption(task.get("caption") or "")
+
+    # сначала публикуем, исходник удаляем только после успешной отправки:
+    # задача уже снята с очереди, и при ошибке отправки пост иначе пропал бы целиком
+    await _send_to_channel(items, caption)
+    await _delete_old_source_if_possible(task)
+
 # ======================
 # АВТОПОСТ В СЛОТЫ
 # ======================
 
 async def scheduled_post():
-    task = db_dequeue_oldest()
+    task = await db_dequeue_oldest()
     if not task:
         return
     await publish_task(task)
@@ -442,19 +620,61 @@ async def scheduled_post():
 async def _on_startup():
     log.info("🚀 Стартуем Layoutplace Bot...")
     # превью — каждый 0-й секунды минуты
-    scheduler.add_job(preview_job, CronTrigger(second="0", minute="*"))
+    scheduler.add_job(preview_job, CronTrigger(second="0", minute="*", timezone=_TZ_INFO))
     # слоты
-    for t in POST_TIMES:
-        hh, mm = [int(x) for x in t.split(":")]
-        scheduler.add_job(scheduled_post, CronTrigger(hour=hh, minute=mm))
+    for hh, mm in _SLOTS:
+        scheduler.add_job(scheduled_post, CronTrigger(hour=hh, minute=mm, timezone=_TZ_INFO))
     scheduler.start()
-    log.info(f"Scheduler TZ={TZ}, times={POST_TIMES}, preview_before={PREVIEW_BEFORE_MIN} мин")
-    # сборщик альбомов
+    log.info("Scheduler TZ=%s, times=%s, preview_before=%s мин", TZ, POST_TIMES, PREVIEW_BEFORE_MIN)
+    # сборщик альбомов (+ то, что не успели собрать до рестарта)
+    await _restore_album_buffer()
     asyncio.create_task(_album_collector_loop())
 
+async def _run_webhook():
+    app = web.Application()
+    # handle_in_background=False: ответ Telegram уходит после хендлера, а с
+    # max_connections=1 следующий апдейт придёт только после него — по очереди,
+    # как при polling с handle_as_tasks=False (куски альбома не перемешиваются)
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=False,
+        secret_token=WEBHOOK_SECRET,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host="0.0.0.0", port=PORT).start()
+    await bot.set_webhook(
+        WEBHOOK_URL + WEBHOOK_PATH,
+        allowed_updates=dp.resolve_used_update_types(),
+        secret_token=WEBHOOK_SECRET,
+        max_connections=1,
+    )
+    log.info("Webhook: %s%s, порт %s", WEBHOOK_URL, WEBHOOK_PATH, PORT)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
 async def run_bot():
     await _on_startup()
-    await dp.start_polling(bot)
+    if WEBHOOK_URL:
+        await _run_webhook()
+        return
+    # вебхук, оставшийся с прошлого запуска, не даст читать getUpdates
+    await bot.delete_webhook()
+    # просим у Telegram только те типы апдейтов, на которые есть хендлеры (message, callback_query) —
+    # остальные не качаются и не проходят pydantic-валидацию.
+    # handle_as_tasks=False: апдейты из пачки обрабатываем по очереди — всплеск репостов
+    # не плодит сотни задач разом, а куски альбома попадают в буфер в порядке прихода
+    await dp.start_polling(
+        bot,
+        handle_as_tasks=False,
+        polling_timeout=POLLING_TIMEOUT,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
 
 if __name__ == "__main__":
     asyncio.run(run_bot())
@@ -16,7 +16,8 @@ try:
 except Exception:
     TOKEN = os.getenv("BOT_TOKEN", "")
     CHANNEL_ID = int(os.getenv("CHANNEL_ID", "-1000000000000"))
-    ADMINS = [int(x) for x in os.getenv("ADMINS", "").replace(" ", "").split(",") if x]
+    from config import parse_admins
+    ADMINS = parse_admins(os.getenv("ADMINS", ""))
     TZ = os.getenv("TZ", "Europe/Moscow")
     POST_TIMES = os.getenv("POST_TIMES", "12:00,16:00,20:00")
     PREVIEW_MINUTES = int(os.getenv("PREVIEW_MINUTES", "45"))
@@ -25,7 +26,7 @@ from storage.db import (
     init_db,
     get_count,
     peek_oldest,
-    dequeue_oldest,
+    fetch_and_pop_oldest,
 )
 
 log = logging.getLogger("layoutplace_scheduler")
@@ -40,6 +41,7 @@ def _parse_times(s: str) -> List[Tuple[int,int]]:
         out.append((int(hh), int(mm)))
     return out
 
+# неверный TZ должен остановить запуск (ZoneInfoNotFoundError), а не сдвинуть все слоты в UTC
 TZINFO = ZoneInfo(TZ)
 SLOTS: List[Tuple[int,int]] = _parse_times(POST_TIMES)
 
@@ -48,23 +50,29 @@ _sent_preview_keys = set()
 _done_post_keys = set()
 _last_day_key: Optional[str] = None
 
+# date.isoformat() даёт тот же "YYYY-MM-DD", но без разбора формата strftime
 def _day_key(dt: datetime) -> str:
-    return dt.strftime("%Y-%m-%d")
+    return dt.date().isoformat()
 
 def _slot_key(dt: datetime, hh: int, mm: int) -> str:
-    return f"{dt.strftime('%Y-%m-%d')} {hh:02d}:{mm:02d}"
+    return f"{dt.date().isoformat()} {hh:02d}:{mm:02d}"
 
 async def _notify_admins(bot: Bot, text: str):
-    for uid in ADMINS:
-        try:
-            await bot.send_message(uid, text, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
-        except Exception as e:
-            log.warning(f"Админ {uid} недоступен: {e}")
-
-async def _post_one(bot: Bot):
-    task = dequeue_oldest()
+    # рассылаем параллельно: ждём самого медленного админа, а не сумму всех
+    admins = list(ADMINS)
+    results = await asyncio.gather(
+        *(bot.send_message(uid, text, parse_mode=ParseMode.HTML, disable_web_page_preview=True) for uid in admins),
+        return_exceptions=True,
+    )
+    for uid, res in zip(admins, results):
+        if isinstance(res, Exception):
+            log.warning("Админ %s недоступен: %s", uid, res)
+
+async def _post_one(bot: Bot) -> Optional[int]:
+    """Опубликовать самый старый пост. Возвращает остаток очереди или None, если публиковать нечего."""
+    task, left = fetch_and_pop_oldest()
     if not task:
-        return False
+        return None
 
     caption = task.get("caption") or ""
     src = task.get("src")
@@ -84,8 +92,8 @@ async def _post_one(bot: Bot):
         try:
             await bot.delete_message(chat_id=src_chat_id, message_id=src_msg_id)
         except Exception as del_err:
-            log.warning(f"Не смог удалить старое сообщение {src_chat_id}/{src_msg_id}: {del_err}")
-        return True
+            log.warning("Не смог удалить старое сообщение %s/%s: %s", src_chat_id, src_msg_id, del_err)
+        return left
 
     # items собранные
     if items:
@@ -96,13 +104,16 @@ async def _post_one(bot: Bot):
                 fid = it.get("file_id")
                 if not fid:
                     continue
+                # parse_mode нужен только элементу с подписью, остальным — лишнее поле в запросе
+                cap = caption if i == 0 else None
+                pm = ParseMode.HTML if cap else None
                 if t == "photo":
-                    media.append(InputMediaPhoto(media=fid, caption=caption if i == 0 else None, parse_mode=ParseMode.HTML))
+                    media.append(InputMediaPhoto(media=fid, caption=cap, parse_mode=pm))
                 elif t == "video":
-                    media.append(InputMediaVideo(media=fid, caption=caption if i == 0 else None, parse_mode=ParseMode.HTML))
+                    media.append(InputMediaVideo(media=fid, caption=cap, parse_mode=pm))
             if media:
                 await bot.send_media_group(chat_id=CHANNEL_ID, media=media)
-                return True
+                return left
         else:
             it = items[0]
             t = it.get("type")
@@ -113,16 +124,16 @@ async def _post_one(bot: Bot):
                 await bot.send_video(chat_id=CHANNEL_ID, video=fid, caption=caption, parse_mode=ParseMode.HTML)
             else:
                 await bot.send_message(chat_id=CHANNEL_ID, text=caption, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
-            return True
+            return left
 
     # просто текст
     await bot.send_message(chat_id=CHANNEL_ID, text=caption, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
-    return True
+    return left
 
 async def run_scheduler():
     init_db()
     bot = Bot(TOKEN)
-    log.info(f"Scheduler TZ={TZ}, times={POST_TIMES}, preview_before={PREVIEW_MINUTES} min")
+    log.info("Scheduler TZ=%s, times=%s, preview_before=%s min", TZ, POST_TIMES, PREVIEW_MINUTES)
 
     global _last_day_key, _sent_preview_keys, _done_post_keys
     while True:
@@ -163,9 +174,9 @@ async def run_scheduler():
 
             # публикация
             if now >= slot and key not in _done_post_keys:
-                ok = await _post_one(bot)
-                if ok:
-                    await _notify_admins(bot, f"Опубликовано (слот {slot.strftime('%H:%M')}). Осталось в очереди: {get_count()}")
+                left = await _post_one(bot)
+                if left is not None:
+                    await _notify_admins(bot, f"Опубликовано (слот {slot.strftime('%H:%M')}). Осталось в очереди: {left}")
                 _done_post_keys.add(key)
 
         await asyncio.sleep(20)
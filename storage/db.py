@@ -1,22 +1,77 @@
 import os
 import json
 import time
+import queue
 import sqlite3
-from typing import Any, Dict, List, Optional, Tuple
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 DB_PATH = os.getenv("DB_PATH", "/data/data.db")
 
+# соединения живут весь процесс: одно пишущее (записи сериализуем локом) + пул читающих.
+# вызовы приходят из рабочих потоков (пул в main.py), поэтому check_same_thread=False
+_WRITER: Optional[sqlite3.Connection] = None
+_WRITE_LOCK = threading.Lock()
+_READERS: "queue.SimpleQueue[sqlite3.Connection]" = queue.SimpleQueue()
+
+_PRAGMAS = (
+    # в WAL режим NORMAL безопасен для целостности и не делает fsync на каждый коммит
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-20000",   # ~20 МБ страниц на соединение
+)
+
 # ---------- low-level ----------
 
-def _connect() -> sqlite3.Connection:
+def _open() -> sqlite3.Connection:
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    cx = sqlite3.connect(DB_PATH)
+    # isolation_level=None: транзакции открываем сами (BEGIN IMMEDIATE в _write)
+    cx = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
     cx.row_factory = sqlite3.Row
+    for p in _PRAGMAS:
+        cx.execute(p)
     return cx
 
+def _writer() -> sqlite3.Connection:
+    global _WRITER
+    if _WRITER is None:
+        _WRITER = _open()
+    return _WRITER
+
+@contextmanager
+def _write() -> Iterator[sqlite3.Connection]:
+    """Транзакция на пишущем соединении.
+    IMMEDIATE: берём блокировку записи сразу, до SELECT — два воркера не заберут одну строку."""
+    with _WRITE_LOCK:
+        cx = _writer()
+        cx.execute("BEGIN IMMEDIATE")
+        try:
+            yield cx
+        except BaseException:
+            cx.rollback()
+            raise
+        cx.commit()
+
+@contextmanager
+def _read() -> Iterator[sqlite3.Connection]:
+    """Читающее соединение из пула; пул растёт до числа одновременных потоков."""
+    try:
+        cx = _READERS.get_nowait()
+    except queue.Empty:
+        cx = _open()
+        cx.execute("PRAGMA query_only=ON")
+    try:
+        yield cx
+    finally:
+        _READERS.put(cx)
+
 def init_db() -> None:
-    cx = _connect()
-    with cx:
+    with _WRITE_LOCK:
+        # WAL хранится в самом файле БД: читатели (peek/stats) не блокируют запись
+        _writer().execute("PRAGMA journal_mode=WAL")
+    with _write() as cx:
         cx.execute("""
         CREATE TABLE IF NOT EXISTS queue (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -24,6 +79,7 @@ def init_db() -> None:
             caption TEXT,                -- нормализованный текст
             src_chat_id INTEGER,
             src_msg_id INTEGER,
+            src_msg_ids TEXT,            -- JSON [id, ...]: все сообщения исходного альбома
             created_at INTEGER NOT NULL
         )
         """)
@@ -33,18 +89,69 @@ def init_db() -> None:
             value TEXT
         )
         """)
+        cx.execute("""
+        CREATE TABLE IF NOT EXISTS album_buf (
+            gid TEXT PRIMARY KEY,        -- media_group_id
+            payload TEXT NOT NULL,       -- JSON, как в queue.payload
+            caption TEXT,
+            src_chat_id INTEGER,
+            src_msg_id INTEGER,
+            src_msg_ids TEXT
+        )
+        """)
+        # базы, созданные до появления src_msg_ids
+        _add_column_if_missing(cx, "queue", "src_msg_ids", "TEXT")
+        _add_column_if_missing(cx, "album_buf", "src_msg_ids", "TEXT")
+        # размер очереди ведут триггеры: /queue читает одну строку вместо COUNT(*) по таблице,
+        # и счётчик общий для всех процессов, работающих с этим файлом
+        cx.execute("""
+        CREATE TABLE IF NOT EXISTS queue_stats (
+            k TEXT PRIMARY KEY,
+            v INTEGER NOT NULL
+        )
+        """)
+        cx.execute("""
+        CREATE TRIGGER IF NOT EXISTS queue_count_ins AFTER INSERT ON queue
+        BEGIN UPDATE queue_stats SET v = v + 1 WHERE k = 'count'; END
+        """)
+        cx.execute("""
+        CREATE TRIGGER IF NOT EXISTS queue_count_del AFTER DELETE ON queue
+        BEGIN UPDATE queue_stats SET v = v - 1 WHERE k = 'count'; END
+        """)
+        # на старте пересчитываем один раз — на случай базы, созданной до триггеров
+        cx.execute("""
+        INSERT INTO queue_stats(k, v) VALUES('count', (SELECT COUNT(*) FROM queue))
+        ON CONFLICT(k) DO UPDATE SET v = excluded.v
+        """)
+
+def _add_column_if_missing(cx: sqlite3.Connection, table: str, column: str, decl: str) -> None:
+    cols = {r["name"] for r in cx.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        cx.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def _ids_json(ids: Optional[List[int]]) -> Optional[str]:
+    return json.dumps(ids) if ids else None
+
+# ---------- счётчик очереди ----------
+
+def _count(cx: sqlite3.Connection) -> int:
+    """Размер очереди из queue_stats (ведут триггеры)."""
+    row = cx.execute("SELECT v FROM queue_stats WHERE k = 'count'").fetchone()
+    return int(row["v"]) if row else 0
+
+def _queue_count() -> int:
+    with _read() as cx:
+        return _count(cx)
 
 # ---------- meta helpers ----------
 
 def meta_get(key: str) -> Optional[str]:
-    cx = _connect()
-    cur = cx.execute("SELECT value FROM meta WHERE key = ?", (key,))
-    row = cur.fetchone()
+    with _read() as cx:
+        row = cx.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
     return row["value"] if row else None
 
 def meta_set(key: str, value: str) -> None:
-    cx = _connect()
-    with cx:
+    with _write() as cx:
         cx.execute(
             "INSERT INTO meta(key, value) VALUES(?, ?) "
             "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
@@ -59,6 +166,38 @@ def get_last_channel_msg_id() -> Optional[int]:
 def set_last_channel_msg_id(msg_id: int) -> None:
     meta_set("last_channel_msg_id", str(msg_id))
 
+# ---------- недособранные альбомы (переживают рестарт) ----------
+
+def save_album_bucket(gid: str, items: List[Dict[str, Any]], caption: str,
+                      src: Tuple[Optional[int], Optional[int]],
+                      src_msg_ids: Optional[List[int]] = None) -> None:
+    src_chat_id, src_msg_id = src
+    with _write() as cx:
+        cx.execute("""
+            INSERT OR REPLACE INTO album_buf(gid, payload, caption, src_chat_id, src_msg_id, src_msg_ids)
+            VALUES(?,?,?,?,?,?)
+        """, (gid, json.dumps(items, ensure_ascii=False), caption, src_chat_id, src_msg_id,
+              _ids_json(src_msg_ids)))
+
+def load_album_buckets() -> List[Dict[str, Any]]:
+    """Все сохранённые альбомы: [{"gid", "items", "caption", "src", "src_msg_ids"}, ...]."""
+    with _read() as cx:
+        rows = cx.execute("SELECT * FROM album_buf").fetchall()
+    return [
+        {
+            "gid": r["gid"],
+            "items": json.loads(r["payload"] or "[]"),
+            "caption": r["caption"] or "",
+            "src": (r["src_chat_id"], r["src_msg_id"]),
+            "src_msg_ids": json.loads(r["src_msg_ids"] or "[]"),
+        }
+        for r in rows
+    ]
+
+def delete_album_bucket(gid: str) -> None:
+    with _write() as cx:
+        cx.execute("DELETE FROM album_buf WHERE gid = ?", (gid,))
+
 # ---------- helpers for row shape ----------
 
 def _row_to_task(row: sqlite3.Row) -> Dict[str, Any]:
@@ -70,42 +209,85 @@ def _row_to_task(row: sqlite3.Row) -> Dict[str, Any]:
 
 # ---------- queue API ----------
 
-def enqueue(items: List[Dict[str, Any]], caption: str,
-            src: Tuple[Optional[int], Optional[int]]) -> int:
-    """Добавить в очередь. items — список dict: {"type": "photo"|"video"|"document", "file_id": "..."}"""
+def _insert(cx: sqlite3.Connection, items: List[Dict[str, Any]], caption: str,
+            src: Tuple[Optional[int], Optional[int]], src_msg_ids: Optional[List[int]]) -> int:
     src_chat_id, src_msg_id = src
-    cx = _connect()
-    with cx:
-        cur = cx.execute("""
-            INSERT INTO queue(payload, caption, src_chat_id, src_msg_id, created_at)
-            VALUES(?,?,?,?,?)
-        """, (json.dumps(items, ensure_ascii=False), caption, src_chat_id, src_msg_id, int(time.time())))
-        return cur.lastrowid
+    cur = cx.execute("""
+        INSERT INTO queue(payload, caption, src_chat_id, src_msg_id, src_msg_ids, created_at)
+        VALUES(?,?,?,?,?,?)
+    """, (json.dumps(items, ensure_ascii=False), caption, src_chat_id, src_msg_id,
+          _ids_json(src_msg_ids), int(time.time())))
+    return cur.lastrowid
+
+def enqueue(items: List[Dict[str, Any]], caption: str,
+            src: Tuple[Optional[int], Optional[int]],
+            src_msg_ids: Optional[List[int]] = None) -> int:
+    """Добавить в очередь. items — список dict: {"type": "photo"|"video"|"document", "file_id": "..."}
+    src_msg_ids — все id исходного альбома в src_chat_id (для удаления одним запросом)."""
+    with _write() as cx:
+        return _insert(cx, items, caption, src, src_msg_ids)
+
+def enqueue_counted(items: List[Dict[str, Any]], caption: str,
+                    src: Tuple[Optional[int], Optional[int]],
+                    src_msg_ids: Optional[List[int]] = None) -> Tuple[int, int]:
+    """enqueue + размер очереди после вставки — одной транзакцией: (id, queued)."""
+    with _write() as cx:
+        qid = _insert(cx, items, caption, src, src_msg_ids)
+        queued = _count(cx)
+    return int(qid), queued
+
+def enqueue_album(gid: str, items: List[Dict[str, Any]], caption: str,
+                  src: Tuple[Optional[int], Optional[int]],
+                  src_msg_ids: Optional[List[int]] = None) -> Tuple[int, int]:
+    """Перенести собранный альбом из album_buf в очередь — одной транзакцией: (id, queued).
+    Падение между вставкой и удалением из буфера поставило бы альбом в очередь дважды."""
+    with _write() as cx:
+        qid = _insert(cx, items, caption, src, src_msg_ids)
+        cx.execute("DELETE FROM album_buf WHERE gid = ?", (gid,))
+        queued = _count(cx)
+    return int(qid), queued
+
+def _pop_oldest(cx: sqlite3.Connection) -> Optional[sqlite3.Row]:
+    """SELECT + DELETE самого старого; вызывать внутри транзакции."""
+    row = cx.execute("SELECT * FROM queue ORDER BY id LIMIT 1").fetchone()
+    if row:
+        cx.execute("DELETE FROM queue WHERE id = ?", (row["id"],))
+    return row
 
 def dequeue_oldest() -> Optional[Dict[str, Any]]:
     """Достать и удалить самый старый элемент."""
-    cx = _connect()
-    cur = cx.execute("SELECT * FROM queue ORDER BY id LIMIT 1")
-    row = cur.fetchone()
-    if not row:
-        return None
-    with cx:
-        cx.execute("DELETE FROM queue WHERE id = ?", (row["id"],))
+    with _write() as cx:
+        row = _pop_oldest(cx)
+    return _row_to_task(row) if row else None
+
+def pop_oldest_if(qid: int) -> Optional[Dict[str, Any]]:
+    """Достать и удалить самый старый элемент, только если это qid (кнопка «опубликовать» в превью)."""
+    with _write() as cx:
+        row = cx.execute("SELECT * FROM queue ORDER BY id LIMIT 1").fetchone()
+        if not row or row["id"] != qid:
+            return None
+        cx.execute("DELETE FROM queue WHERE id = ?", (qid,))
     return _row_to_task(row)
 
+def fetch_and_pop_oldest() -> Tuple[Optional[Dict[str, Any]], int]:
+    """Достать и удалить самый старый элемент + сколько осталось — одной транзакцией."""
+    with _write() as cx:
+        row = _pop_oldest(cx)
+        left = _count(cx)
+    return (_row_to_task(row) if row else None), left
+
 # --- совместимость/удобные выборки ---
 
 def peek_oldest() -> Optional[Dict[str, Any]]:
     """Вернуть самый старый элемент без удаления (для превью)."""
-    cx = _connect()
-    cur = cx.execute("SELECT * FROM queue ORDER BY id LIMIT 1")
-    row = cur.fetchone()
+    with _read() as cx:
+        row = cx.execute("SELECT * FROM queue ORDER BY id LIMIT 1").fetchone()
     return _row_to_task(row) if row else None
 
 def peek_all() -> List[Dict[str, Any]]:
-    cx = _connect()
-    cur = cx.execute("SELECT * FROM queue ORDER BY id")
-    return [_row_to_task(r) for r in cur.fetchall()]
+    with _read() as cx:
+        rows = cx.execute("SELECT * FROM queue ORDER BY id").fetchall()
+    return [_row_to_task(r) for r in rows]
 
 def get_queue() -> List[Dict[str, Any]]:
     """Алиас под разные версии main.py."""
@@ -116,22 +298,16 @@ def list_queue() -> List[Dict[str, Any]]:
     return peek_all()
 
 def stats() -> Dict[str, int]:
-    cx = _connect()
-    cur = cx.execute("SELECT COUNT(*) AS c FROM queue")
-    queued = cur.fetchone()["c"]
-    return {"queued": queued}
+    return {"queued": _queue_count()}
 
 def get_count() -> int:
     """Ровно то, что ожидает main.py."""
-    cx = _connect()
-    cur = cx.execute("SELECT COUNT(*) AS c FROM queue")
-    return int(cur.fetchone()["c"])
+    return _queue_count()
 
 def delete_by_id(qid: int) -> int:
-    cx = _connect()
-    with cx:
+    with _write() as cx:
         cur = cx.execute("DELETE FROM queue WHERE id = ?", (qid,))
-        return cur.rowcount
+    return cur.rowcount
 
 def remove_by_id(qid: int) -> int:
     """Алиас имени, которое зовёт main.py."""
@@ -142,13 +318,11 @@ def delete_post(qid: int) -> int:
     return delete_by_id(qid)
 
 def last_id() -> Optional[int]:
-    cx = _connect()
-    cur = cx.execute("SELECT id FROM queue ORDER BY id DESC LIMIT 1")
-    row = cur.fetchone()
+    with _read() as cx:
+        row = cx.execute("SELECT id FROM queue ORDER BY id DESC LIMIT 1").fetchone()
     return row["id"] if row else None
 
 def clear_queue() -> int:
-    cx = _connect()
-    with cx:
+    with _write() as cx:
         cur = cx.execute("DELETE FROM queue")
-        return cur.rowcount
+    return cur.rowcount